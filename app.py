@@ -6,12 +6,21 @@ import uuid
 import threading
 import json
 import re
+import math
 import logging
 from datetime import datetime, timedelta
 import time
 import shutil
+import signal
+import itertools
+import argparse
 from pathlib import Path
 
+try:
+    import resource  # Apenas POSIX (limites dos processos filhos)
+except ImportError:
+    resource = None
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -22,6 +31,33 @@ app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
 app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024  # 1GB limite
 app.config['MAX_FILE_AGE_HOURS'] = 0.25  # Arquivos expiram em 1 hora
 app.config['CLEANUP_INTERVAL_MINUTES'] = 5  # Limpar a cada 5 minutos
+app.config['JOURNAL_MAX_RESUMES'] = 3  # Tentativas de retomada após reinício
+app.config['STALL_TIMEOUT_SECONDS'] = 120  # Sem progresso por 2 minutos = travado
+app.config['POSTPROCESS_TIMEOUT_SECONDS'] = 3600  # ffmpeg (merge, conversão) não gera saída
+app.config['STALL_MAX_RETRIES'] = 2  # Novas tentativas após um travamento
+app.config['STALL_RETRY_BACKOFF_SECONDS'] = 10  # Espera base (dobra a cada tentativa)
+app.config['WATCHDOG_INTERVAL_SECONDS'] = 15  # Frequência de verificação do watchdog
+app.config['MAX_CONCURRENT_DOWNLOADS'] = 4  # Downloads simultâneos no servidor inteiro
+app.config['SHORT_LANE_SLOTS'] = 1  # Vagas reservadas para jobs curtos
+app.config['SHORT_JOB_COST'] = 900  # Custo máximo de um job curto (~15 min de áudio)
+app.config['QUEUE_AGING_RATE'] = 60  # Custo descontado por segundo de espera na fila
+app.config['INFO_CACHE_SECONDS'] = 600  # Cache das informações do vídeo por URL
+app.config['SERVER_HOST'] = '0.0.0.0'
+app.config['SERVER_PORT'] = 5003
+app.config['SERVER_THREADS'] = 16  # Threads do servidor de produção
+app.config['DRAIN_TIMEOUT_SECONDS'] = 300  # Espera pelos downloads ao receber SIGTERM
+
+# Prioridade e limites por classe de processo filho (None = sem limite).
+# A classe vale para a árvore inteira do yt-dlp: o ffmpeg é iniciado por ele e
+# herda os limites, então a classe é escolhida pelo preset do job (ver
+# TRANSCODE_OPTIONS), não pelo tipo de processo. 'metadata' é o --dump-json.
+# nice: 0-19 | ionice: 0-7 (classe best-effort, só Linux) | cpu_seconds,
+# address_space_mb, open_files: rlimits (via prlimit, Linux)
+app.config['CHILD_PROCESS_LIMITS'] = {
+    'metadata': {'nice': 5, 'ionice': 4, 'cpu_seconds': 60, 'address_space_mb': 2048, 'open_files': 256},
+    'download': {'nice': 5, 'ionice': 4, 'cpu_seconds': 3600, 'address_space_mb': 4096, 'open_files': 1024},
+    'transcode': {'nice': 10, 'ionice': 7, 'cpu_seconds': 7200, 'address_space_mb': 8192, 'open_files': 1024}
+}
 
 # Configurações de caminhos
 if getattr(sys, 'frozen', False):
@@ -33,15 +69,426 @@ download_path = os.path.join(base_path, "downloads")
 ytdlp_path = os.path.join(base_path, "yt-dlp.exe")
 ffmpeg_path = os.path.join(base_path, "ffmpeg.exe")
 ffprobe_path = os.path.join(base_path, "ffprobe.exe")
+journal_path = os.path.join(base_path, "jobs.journal")
+
+# Peso de cada opção no custo estimado (duração em segundos × peso)
+OPTION_COST_WEIGHTS = {
+    "Audio Standard MP3": 1.0,
+    "Audio Best Quality": 0.8,
+    "Video MP4 Full HD": 3.0,
+    "Video Best Quality": 5.0
+}
+DEFAULT_DURATION_SECONDS = 600  # Usado quando a duração é desconhecida (lives, etc.)
+
+# Presets com trabalho pesado de ffmpeg (conversão para MP3, merge de vídeo +
+# áudio com embed de legendas/thumbnail, inclusive 4K): limites de 'transcode'
+TRANSCODE_OPTIONS = {"Audio Standard MP3", "Video MP4 Full HD", "Video Best Quality"}
 
 # Criar pastas necessárias
 if not os.path.exists(download_path):
     os.makedirs(download_path)
 
 # Armazenamento de status de download por sessão
-download_sessions = {}  # {session_id: {downloads: [], status: {}}}
+download_sessions = {}  # {session_id: {downloads: [], status: {}, version: int}}
 _status_lock = threading.Lock()
 
+# Versões das sessões vêm de uma sequência global: uma sessão recriada nunca
+# repete uma versão antiga, e o BOOT_ID invalida os ETags após um reinício
+_session_versions = itertools.count(1)
+BOOT_ID = uuid.uuid4().hex[:8]
+
+def touch_session(session_id):
+    """Marca a sessão como alterada (chamar com _status_lock adquirido)"""
+    if session_id in download_sessions:
+        download_sessions[session_id]['version'] = next(_session_versions)
+
+def touch_sessions(session_ids):
+    """Marca várias sessões como alteradas (adquire o _status_lock)"""
+    with _status_lock:
+        for session_id in session_ids:
+            touch_session(session_id)
+
+class JobJournal:
+    """Diário append-only dos jobs de download (sobrevive a reinícios)"""
+    
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._jobs = {}  # Último estado de cada job, espelhando o arquivo
+        self._appended = 0  # Registros gravados desde a última compactação
+    
+    def record(self, event, download_id, **fields):
+        """Grava um evento (queued, running, completed, failed) no diário"""
+        entry = {
+            'event': event,
+            'download_id': download_id,
+            'ts': datetime.now().isoformat(),
+            **fields
+        }
+        line = json.dumps(entry, ensure_ascii=False)
+        
+        with self._lock:
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                logger.error(f"Erro ao gravar no diário de jobs: {e}")
+            self._jobs.setdefault(download_id, {}).update(entry)
+            self._appended += 1
+    
+    def replay(self):
+        """Reproduz o diário e retorna o último estado conhecido de cada job"""
+        jobs = {}
+        if not os.path.exists(self.path):
+            return jobs
+        
+        with self._lock:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Linha truncada por um crash no meio da escrita
+                        continue
+                    jobs.setdefault(entry['download_id'], {}).update(entry)
+        
+        return jobs
+    
+    def compact(self, jobs=None):
+        """Reescreve o diário com apenas um registro por job.
+        
+        Sem argumentos, usa o estado atual dos jobs e descarta os finalizados
+        há mais tempo que MAX_FILE_AGE_HOURS (chamado pela limpeza periódica).
+        """
+        temp_path = self.path + '.tmp'
+        
+        with self._lock:
+            if jobs is None:
+                if not self._appended:
+                    return
+                max_age = timedelta(hours=app.config['MAX_FILE_AGE_HOURS'])
+                now = datetime.now()
+                jobs = [
+                    job for job in self._jobs.values()
+                    if job.get('event') not in ('completed', 'failed', 'cancelled')
+                    or now - datetime.fromisoformat(job['ts']) <= max_age
+                ]
+            jobs = [dict(job) for job in jobs]
+            self._jobs = {job['download_id']: job for job in jobs}
+            self._appended = 0
+            
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    for job in jobs:
+                        f.write(json.dumps(job, ensure_ascii=False) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                logger.error(f"Erro ao compactar diário de jobs: {e}")
+
+job_journal = JobJournal(journal_path)
+
+# Processos yt-dlp em execução e cancelamentos pedidos pelos usuários
+active_processes = {}  # {download_id: {process, session_id, last_activity, phase, stalled}}
+cancelled_downloads = set()
+_process_lock = threading.Lock()
+
+# Pós-processadores do yt-dlp: rodam o ffmpeg com a saída capturada, então
+# ficam em silêncio por minutos em mídias longas ou 4K
+POSTPROCESSOR_TAG = re.compile(
+    r'^\[(Merger|ExtractAudio|EmbedThumbnail|EmbedSubtitle|Metadata|Fixup\w*|'
+    r'VideoConvertor|VideoRemuxer|ThumbnailsConvertor|SubtitlesConvertor|'
+    r'ModifyChapters|SplitChapters|SponsorBlock)\]'
+)
+
+# Sinalizado ao receber SIGTERM: novos jobs são recusados durante a drenagem
+shutdown_event = threading.Event()
+
+# Contadores de monitoramento do watchdog
+watchdog_stats = {'stalled': 0, 'killed': 0, 'retried': 0, 'cancelled': 0}
+
+# Uso de recursos acumulado por classe de processo filho
+resource_stats = {
+    child_class: {'jobs': 0, 'cpu_seconds': 0.0, 'max_rss_kb': 0, 'read_bytes': 0, 'write_bytes': 0}
+    for child_class in ('download', 'transcode')
+}
+
+def process_group_kwargs():
+    """Argumentos do Popen para criar o processo em um grupo próprio"""
+    if sys.platform == 'win32':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+def child_command(cmd, child_class):
+    """Prefixa o comando com prlimit, nice e ionice conforme a classe (POSIX).
+    
+    Os limites são aplicados por wrappers que fazem exec no próprio PID, sem
+    executar Python entre o fork e o exec (preexec_fn não é seguro com threads).
+    """
+    if sys.platform == 'win32':
+        return cmd
+    limits = app.config['CHILD_PROCESS_LIMITS'][child_class]
+    prefix = []
+    
+    if resource is not None and shutil.which('prlimit'):
+        for key, option, rlimit, scale in [
+            ('cpu_seconds', '--cpu', resource.RLIMIT_CPU, 1),
+            ('address_space_mb', '--as', resource.RLIMIT_AS, 1024 * 1024),
+            ('open_files', '--nofile', resource.RLIMIT_NOFILE, 1)
+        ]:
+            if limits.get(key) is None:
+                continue
+            value = int(limits[key] * scale)
+            # O filho herda o hard limit deste processo: o soft não pode passar dele
+            hard = resource.getrlimit(rlimit)[1]
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            prefix.append(f"{option}={value}:")
+        if prefix:
+            prefix = ["prlimit"] + prefix + ["--"]
+    
+    if limits.get('nice') and shutil.which('nice'):
+        prefix += ["nice", "-n", str(limits['nice'])]
+    
+    level = limits.get('ionice')
+    if level is not None and sys.platform.startswith('linux') and shutil.which('ionice'):
+        prefix += ["ionice", "-c", "2", "-n", str(level)]
+    
+    return prefix + cmd
+
+def child_popen_kwargs(child_class, new_group=False):
+    """Argumentos do Popen: grupo de processos e, no Windows, a classe de prioridade"""
+    kwargs = process_group_kwargs() if new_group else {}
+    
+    if sys.platform == 'win32':
+        # Windows não tem rlimits: apenas a classe de prioridade
+        nice = app.config['CHILD_PROCESS_LIMITS'][child_class].get('nice') or 0
+        if nice >= 15:
+            priority = subprocess.IDLE_PRIORITY_CLASS
+        elif nice > 0:
+            priority = subprocess.BELOW_NORMAL_PRIORITY_CLASS
+        else:
+            priority = 0
+        kwargs['creationflags'] = kwargs.get('creationflags', 0) | priority
+    
+    return kwargs
+
+def wait_with_rusage(process):
+    """Aguarda o processo e retorna o uso de recursos dele e dos filhos que ele aguardou"""
+    if not hasattr(os, 'wait4'):
+        process.wait()
+        return None
+    
+    try:
+        _, wait_status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # Já coletado por um poll() concorrente (ex.: kill_process_tree)
+        process.wait()
+        return None
+    process.returncode = os.waitstatus_to_exitcode(wait_status)
+    
+    return {
+        'cpu_seconds': round(usage.ru_utime + usage.ru_stime, 3),
+        # ru_maxrss é em KB no Linux e em bytes no macOS
+        'max_rss_kb': usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss,
+        'read_bytes': usage.ru_inblock * 512,
+        'write_bytes': usage.ru_oublock * 512
+    }
+
+def add_resource_usage(total, usage):
+    """Soma o uso de uma execução ao total do job (tentativas de retry incluídas)"""
+    if usage is None:
+        return total
+    if total is None:
+        return dict(usage)
+    return {
+        'cpu_seconds': round(total['cpu_seconds'] + usage['cpu_seconds'], 3),
+        'max_rss_kb': max(total['max_rss_kb'], usage['max_rss_kb']),
+        'read_bytes': total['read_bytes'] + usage['read_bytes'],
+        'write_bytes': total['write_bytes'] + usage['write_bytes']
+    }
+
+def record_resource_usage(child_class, usage):
+    """Agrega o uso de recursos de um job nas estatísticas"""
+    if usage is None:
+        return
+    with _process_lock:
+        stats = resource_stats[child_class]
+        stats['jobs'] += 1
+        stats['cpu_seconds'] = round(stats['cpu_seconds'] + usage['cpu_seconds'], 3)
+        stats['max_rss_kb'] = max(stats['max_rss_kb'], usage['max_rss_kb'])
+        stats['read_bytes'] += usage['read_bytes']
+        stats['write_bytes'] += usage['write_bytes']
+
+def kill_process_tree(process):
+    """Encerra o processo e todos os seus filhos (ffmpeg, etc.)"""
+    if process.poll() is not None:
+        return False
+    
+    try:
+        if sys.platform == 'win32':
+            subprocess.run(
+                ["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                capture_output=True, shell=False, timeout=10
+            )
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.error(f"Erro ao encerrar processo {process.pid}: {e}")
+        process.kill()
+    
+    with _process_lock:
+        watchdog_stats['killed'] += 1
+    return True
+
+class DownloadScheduler:
+    """Escalonador shortest-job-first com envelhecimento e faixa para jobs curtos"""
+    
+    def __init__(self, on_change=None):
+        self._cond = threading.Condition()
+        self._waiting = {}  # {download_id: (custo, momento de entrada)}
+        self._running = {}  # {download_id: custo}
+        self._sessions = {}  # {download_id: session_id} dos jobs na fila
+        self._closed = False
+        # Chamado (fora do lock) com as sessões cuja posição na fila mudou
+        self._on_change = on_change
+    
+    @staticmethod
+    def estimate_cost(duration, option):
+        """Estima o trabalho de um job: duração × peso da opção"""
+        weight = OPTION_COST_WEIGHTS.get(option, OPTION_COST_WEIGHTS["Video Best Quality"])
+        return (duration or DEFAULT_DURATION_SECONDS) * weight
+    
+    def _is_short(self, cost):
+        return cost <= app.config['SHORT_JOB_COST']
+    
+    def _score(self, download_id, now):
+        cost, enqueued = self._waiting[download_id]
+        return cost - (now - enqueued) * app.config['QUEUE_AGING_RATE']
+    
+    def _long_allowed(self):
+        """Jobs longos não podem ocupar as vagas reservadas aos curtos"""
+        slots = app.config['MAX_CONCURRENT_DOWNLOADS']
+        long_running = sum(1 for cost in self._running.values() if not self._is_short(cost))
+        return long_running < slots - app.config['SHORT_LANE_SLOTS']
+    
+    def _next_job(self):
+        """Escolhe o próximo job da fila, ou None se não houver vaga"""
+        if len(self._running) >= app.config['MAX_CONCURRENT_DOWNLOADS']:
+            return None
+        
+        long_allowed = self._long_allowed()
+        now = time.time()
+        candidates = [
+            download_id for download_id, (cost, _) in self._waiting.items()
+            if long_allowed or self._is_short(cost)
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda download_id: self._score(download_id, now))
+    
+    def _waiting_sessions(self):
+        return set(self._sessions.values())
+    
+    def _notify(self, session_ids):
+        if self._on_change and session_ids:
+            self._on_change(session_ids)
+    
+    def acquire(self, download_id, cost, session_id=None):
+        """Bloqueia até o job receber uma vaga; retorna False se foi cancelado"""
+        with self._cond:
+            self._waiting[download_id] = (cost, time.time())
+            self._sessions[download_id] = session_id
+            changed = self._waiting_sessions()
+        self._notify(changed)
+        
+        granted = False
+        with self._cond:
+            while download_id in self._waiting:
+                if self._closed:
+                    # Servidor encerrando: o job continua no diário e será retomado
+                    del self._waiting[download_id]
+                    break
+                if self._next_job() == download_id:
+                    del self._waiting[download_id]
+                    self._running[download_id] = cost
+                    granted = True
+                    break
+                # Timeout para reavaliar o envelhecimento periodicamente
+                self._cond.wait(timeout=1)
+            self._sessions.pop(download_id, None)
+            changed = self._waiting_sessions() | {session_id}
+        self._notify(changed - {None})
+        return granted
+    
+    def release(self, download_id):
+        """Libera a vaga do job (não faz nada se ele não estiver rodando)"""
+        with self._cond:
+            if self._running.pop(download_id, None) is None:
+                return
+            self._cond.notify_all()
+            changed = self._waiting_sessions()
+        self._notify(changed)
+    
+    def cancel(self, download_id):
+        """Remove o job da fila de espera"""
+        with self._cond:
+            if self._waiting.pop(download_id, None) is None:
+                return
+            self._cond.notify_all()
+            changed = self._waiting_sessions()
+        self._notify(changed)
+    
+    def close(self):
+        """Para de liberar vagas (usado ao drenar o servidor)"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+    
+    def position(self, download_id):
+        """Posição atual do job na fila (1 = próximo), ou 0 se não estiver esperando.
+        
+        Jobs que podem começar agora (respeitando a faixa dos curtos) vêm antes
+        dos que estão bloqueados, e dentro de cada grupo vale o score.
+        """
+        with self._cond:
+            if download_id not in self._waiting:
+                return 0
+            now = time.time()
+            long_allowed = self._long_allowed()
+            
+            def rank(job_id):
+                cost, _ = self._waiting[job_id]
+                eligible = long_allowed or self._is_short(cost)
+                return (0 if eligible else 1, self._score(job_id, now))
+            
+            mine = rank(download_id)
+            return 1 + sum(1 for other in self._waiting if rank(other) < mine)
+    
+    def snapshot(self):
+        """Resumo da fila para monitoramento"""
+        with self._cond:
+            return {
+                'running': len(self._running),
+                'running_short': sum(1 for cost in self._running.values() if self._is_short(cost)),
+                'waiting': len(self._waiting),
+                'waiting_short': sum(1 for cost, _ in self._waiting.values() if self._is_short(cost)),
+                'slots': app.config['MAX_CONCURRENT_DOWNLOADS']
+            }
+
+download_scheduler = DownloadScheduler(on_change=touch_sessions)
+
+# Cache de trechos já baixados: {(vídeo, opção, início, fim, preciso): caminho}
+clip_cache = {}
+_clip_cache_lock = threading.Lock()
+
+# Cache das informações do vídeo (evita consultar o yt-dlp duas vezes por download)
+_info_cache = {}  # {url: (momento, info)}
+_info_cache_lock = threading.Lock()
+
 class DownloadManager:
     """Gerencia downloads por usuário/sessão"""
     
@@ -75,9 +522,145 @@ class DownloadManager:
         safe_name = DownloadManager.sanitize_filename(original_name)[:50]
         return f"{safe_name}_{timestamp}_{short_id}{ext}"
     
+    @staticmethod
+    def parse_timestamp(value):
+        """Converte segundos ou 'HH:MM:SS' / 'MM:SS' em segundos"""
+        if isinstance(value, bool):
+            raise ValueError(f"Tempo inválido: {value}")
+        if isinstance(value, (int, float)):
+            seconds = float(value)
+        else:
+            parts = str(value).strip().split(':')
+            if not 1 <= len(parts) <= 3:
+                raise ValueError(f"Tempo inválido: {value}")
+            seconds = 0.0
+            for index, part in enumerate(parts):
+                try:
+                    field = float(part)
+                except ValueError:
+                    raise ValueError(f"Tempo inválido: {value}")
+                # Sem campos negativos; minutos e segundos após ':' vão de 0 a 59
+                if not math.isfinite(field) or field < 0 or (index > 0 and field >= 60):
+                    raise ValueError(f"Tempo inválido: {value}")
+                seconds = seconds * 60 + field
+        
+        # float() aceita 'nan' e 'inf'
+        if not math.isfinite(seconds) or seconds < 0:
+            raise ValueError(f"Tempo inválido: {value}")
+        return seconds
+    
+    @staticmethod
+    def parse_clip_request(data):
+        """Lê start_time/end_time ou chapter da requisição (None = vídeo inteiro)"""
+        start = data.get('start_time')
+        end = data.get('end_time')
+        chapter = data.get('chapter')
+        
+        if chapter is None and start is None and end is None:
+            return None
+        if chapter is not None and (start is not None or end is not None):
+            raise ValueError("Informe um capítulo ou um intervalo de tempo, não ambos")
+        
+        accurate = data.get('accurate_cut', False)
+        if isinstance(accurate, str):
+            # bool("false") seria True e forçaria um re-encode
+            normalized = accurate.strip().lower()
+            if normalized in ('true', '1', 'yes', 'sim'):
+                accurate = True
+            elif normalized in ('false', '0', 'no', 'não', 'nao', ''):
+                accurate = False
+        if accurate is None:
+            accurate = False
+        if not isinstance(accurate, bool):
+            raise ValueError(f"Valor inválido para accurate_cut: {data.get('accurate_cut')}")
+        
+        clip = {'accurate': accurate}
+        if chapter is not None:
+            clip['chapter'] = str(chapter).strip()
+            if not clip['chapter']:
+                raise ValueError("Nome do capítulo vazio")
+            return clip
+        
+        clip['start'] = DownloadManager.parse_timestamp(start) if start is not None else 0.0
+        clip['end'] = DownloadManager.parse_timestamp(end) if end is not None else None
+        if clip['end'] is not None and clip['end'] <= clip['start']:
+            raise ValueError("O fim do trecho deve ser maior que o início")
+        return clip
+    
+    @staticmethod
+    def resolve_clip(clip, video_info):
+        """Converte capítulo em intervalo e ajusta o fim à duração do vídeo"""
+        duration = video_info.get('duration') or 0
+        
+        if 'chapter' in clip:
+            wanted = clip['chapter'].lower()
+            for chapter in video_info.get('chapters', []):
+                if chapter['title'].strip().lower() == wanted:
+                    # Capítulo sem fim vai até o fim do vídeo (validado abaixo)
+                    clip = {
+                        **clip,
+                        'start': chapter['start_time'] or 0,
+                        'end': chapter['end_time']
+                    }
+                    break
+            else:
+                raise ValueError(f"Capítulo não encontrado: {clip['chapter']}")
+        
+        end = clip['end']
+        if duration and (end is None or end > duration):
+            end = duration
+        if end is None:
+            raise ValueError("Duração desconhecida, informe o fim do trecho")
+        if end <= clip['start']:
+            raise ValueError("O início do trecho está além do fim do vídeo")
+        return {**clip, 'end': end}
+    
+    @staticmethod
+    def format_clip_label(clip):
+        """Rótulo do trecho usado no nome do arquivo"""
+        if 'chapter' in clip:
+            return clip['chapter']
+        
+        def fmt(seconds):
+            seconds = int(seconds)
+            return f"{seconds // 3600:02d}.{seconds % 3600 // 60:02d}.{seconds % 60:02d}"
+        
+        return f"{fmt(clip['start'])}-{fmt(clip['end'])}"
+    
+    @staticmethod
+    def clip_cache_key(video_info, url, option, clip):
+        """Chave do cache de trechos: (vídeo, opção, intervalo, corte preciso)"""
+        return (
+            video_info.get('id') or url,
+            option,
+            round(clip['start'], 3),
+            round(clip['end'], 3),
+            clip['accurate']
+        )
+    
     @staticmethod
     def get_video_info(url):
-        """Obtém informações do vídeo usando yt-dlp"""
+        """Obtém informações do vídeo usando yt-dlp (com cache por URL)"""
+        now = time.time()
+        with _info_cache_lock:
+            cached = _info_cache.get(url)
+            if cached and now - cached[0] < app.config['INFO_CACHE_SECONDS']:
+                return cached[1]
+        
+        info = DownloadManager._fetch_video_info(url)
+        
+        if info['success']:
+            with _info_cache_lock:
+                # Descartar entradas expiradas antes de inserir
+                for cached_url in [u for u, (ts, _) in _info_cache.items()
+                                   if now - ts >= app.config['INFO_CACHE_SECONDS']]:
+                    del _info_cache[cached_url]
+                _info_cache[url] = (now, info)
+        return info
+    
+    @staticmethod
+    def _fetch_video_info(url):
+        """Executa o yt-dlp para obter as informações do vídeo"""
         try:
             cmd = [
                 ytdlp_path,
@@ -86,7 +669,11 @@ class DownloadManager:
                 url
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True, shell=False, timeout=30)
+            result = subprocess.run(
+                child_command(cmd, 'metadata'),
+                capture_output=True, text=True, shell=False, timeout=30,
+                **child_popen_kwargs('metadata')
+            )
             
             if result.returncode == 0:
                 info = json.loads(result.stdout)
@@ -96,7 +683,16 @@ class DownloadManager:
                     'author': info.get('uploader', 'Desconhecido'),
                     'duration': info.get('duration', 0),
                     'views': info.get('view_count', 0),
-                    'thumbnail': info.get('thumbnail', '')
+                    'thumbnail': info.get('thumbnail', ''),
+                    'id': info.get('id', ''),
+                    'chapters': [
+                        {
+                            'title': chapter.get('title', ''),
+                            'start_time': chapter.get('start_time') or 0,
+                            'end_time': chapter.get('end_time')
+                        }
+                        for chapter in (info.get('chapters') or [])
+                    ]
                 }
             else:
                 return {
@@ -176,6 +772,7 @@ def schedule_cleanup():
         while True:
             time.sleep(app.config['CLEANUP_INTERVAL_MINUTES'] * 60)
             cleanup_old_files()
+            job_journal.compact()
     
     cleanup_thread = threading.Thread(target=cleanup_task, daemon=True)
     cleanup_thread.start()
@@ -189,22 +786,94 @@ def get_or_create_session():
     
     session_id = session['session_id']
     
-    # Inicializar sessão se não existir
+    # Inicializar sessão se não existir (verificação sem lock no caminho comum)
+    if session_id not in download_sessions:
+        with _status_lock:
+            if session_id not in download_sessions:
+                download_sessions[session_id] = {
+                    'downloads': [],  # Lista de downloads do usuário
+                    'status': {},     # Status dos downloads ativos
+                    'created': datetime.now().isoformat(),
+                    'version': next(_session_versions)
+                }
+    
+    return session_id
+
+def finish_download(session_id, download_id, final_filename, final_filepath, base_name, resources=None):
+    """Registra um download concluído no status, no histórico e no diário.
+    
+    Retorna False (sem registrar nada) se o download foi cancelado nesse meio tempo.
+    """
+    file_size = os.path.getsize(final_filepath)
+    
+    download_info = {
+        'id': download_id,
+        'filename': final_filename,
+        'original_name': base_name,
+        'file_size': file_size,
+        'created': datetime.now().isoformat(),
+        'expires_at': (datetime.now() + timedelta(hours=app.config['MAX_FILE_AGE_HOURS'])).isoformat()
+    }
+    
     with _status_lock:
-        if session_id not in download_sessions:
-            download_sessions[session_id] = {
-                'downloads': [],  # Lista de downloads do usuário
-                'status': {},     # Status dos downloads ativos
-                'created': datetime.now().isoformat()
+        # Um DELETE pode ter chegado depois do fim do processo
+        if download_id in cancelled_downloads:
+            return False
+        if session_id in download_sessions:
+            # Atualizar status
+            download_sessions[session_id]['status'][download_id] = {
+                'status': 'completed',
+                'message': 'Download concluído com sucesso!',
+                'progress': 100,
+                'filename': final_filename,
+                'filepath': final_filepath,
+                'original_name': base_name,
+                'file_size': file_size,
+                'complete_time': datetime.now().isoformat(),
+                'resources': resources
             }
+            touch_session(session_id)
+            
+            # Adicionar à lista de downloads do usuário (manter apenas os últimos 20)
+            download_sessions[session_id]['downloads'].append(download_info)
+            if len(download_sessions[session_id]['downloads']) > 20:
+                download_sessions[session_id]['downloads'] = download_sessions[session_id]['downloads'][-20:]
     
-    return session_id
+    job_journal.record('completed', download_id, filepath=final_filepath, resources=resources, **download_info)
+    return True
+
+def discard_cancelled_file(filepath):
+    """Remove o arquivo final de um download cancelado após terminar"""
+    try:
+        os.remove(filepath)
+    except OSError:
+        pass
 
-def download_task(session_id, download_id, url, option, custom_filename=None):
+def copy_cached_clip(cache_key, final_filepath):
+    """Reaproveita um trecho já baixado; retorna False se não houver no cache"""
+    with _clip_cache_lock:
+        cached_path = clip_cache.get(cache_key)
+        if cached_path and not os.path.exists(cached_path):
+            del clip_cache[cache_key]
+            cached_path = None
+    if not cached_path:
+        return False
+    
+    # Cópia (e não hard link): um inode compartilhado teria um único mtime,
+    # e renovar a expiração da cópia estenderia a do arquivo de outro usuário
+    try:
+        shutil.copyfile(cached_path, final_filepath)
+    except OSError:
+        return False
+    return True
+
+def download_task(session_id, download_id, url, option, custom_filename=None, clip=None):
     """Executa o download em uma thread separada"""
     try:
         # Obter informações do vídeo primeiro
         video_info = DownloadManager.get_video_info(url)
+        if download_id in cancelled_downloads:
+            return False
         if not video_info['success']:
             with _status_lock:
                 if session_id in download_sessions:
@@ -213,10 +882,28 @@ def download_task(session_id, download_id, url, option, custom_filename=None):
                         'message': f"Erro ao obter informações: {video_info['error']}",
                         'progress': 0
                     }
+                    touch_session(session_id)
+            job_journal.record('failed', download_id, message=video_info['error'])
             return False
         
         video_title = video_info['title']
         
+        # Resolver trecho pedido (intervalo ou capítulo)
+        if clip:
+            try:
+                clip = DownloadManager.resolve_clip(clip, video_info)
+            except ValueError as e:
+                with _status_lock:
+                    if session_id in download_sessions:
+                        download_sessions[session_id]['status'][download_id] = {
+                            'status': 'error',
+                            'message': str(e),
+                            'progress': 0
+                        }
+                        touch_session(session_id)
+                job_journal.record('failed', download_id, message=str(e))
+                return False
+        
         # Criar pasta do usuário
         user_folder = DownloadManager.get_user_folder(session_id)
         
@@ -236,6 +923,9 @@ def download_task(session_id, download_id, url, option, custom_filename=None):
             base_name = DownloadManager.sanitize_filename(custom_filename)
         else:
             base_name = DownloadManager.sanitize_filename(video_title)
+            if clip:
+                label = DownloadManager.format_clip_label(clip)
+                base_name = DownloadManager.sanitize_filename(f"{video_title} [{label}]")
         
         final_filename = DownloadManager.generate_filename(base_name, session_id, file_type)
         final_filepath = os.path.join(user_folder, final_filename)
@@ -246,7 +936,15 @@ def download_task(session_id, download_id, url, option, custom_filename=None):
         output_template = temp_filepath
         
         # Base do comando
-        cmd_base = [ytdlp_path, "--ffmpeg-location", base_path, "-o", output_template]
+        # --continue retoma o .part deixado por um download interrompido
+        cmd_base = [ytdlp_path, "--ffmpeg-location", base_path, "--continue", "-o", output_template]
+        
+        # Trecho: o yt-dlp baixa apenas o intervalo (cópia de stream alinhada
+        # aos keyframes); o corte preciso força re-encode nos pontos de corte
+        if clip:
+            cmd_base += ["--download-sections", f"*{clip['start']}-{clip['end']}"]
+            if clip['accurate']:
+                cmd_base += ["--force-keyframes-at-cuts"]
         
         # Configurar comandos baseados na opção selecionada
         if option == "Audio Standard MP3":
@@ -285,107 +983,184 @@ def download_task(session_id, download_id, url, option, custom_filename=None):
         
         # Atualizar status (thread-safe)
         with _status_lock:
+            if download_id in cancelled_downloads:
+                return False
             if session_id in download_sessions:
                 download_sessions[session_id]['status'][download_id] = {
                     'status': 'downloading',
-                    'message': 'Iniciando download...',
+                    'message': 'Aguardando vaga na fila de downloads...',
                     'progress': 0,
                     'logs': [],
                     'start_time': datetime.now().isoformat(),
                     'filename': final_filename,
                     'original_name': base_name
                 }
+                touch_session(session_id)
+        job_journal.record('running', download_id, filename=final_filename, original_name=base_name)
         
-        # Executar processo
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            universal_newlines=True,
-            shell=False
-        )
+        # Trecho idêntico já baixado: reaproveitar sem chamar o yt-dlp
+        clip_key = DownloadManager.clip_cache_key(video_info, url, option, clip) if clip else None
+        if clip_key and copy_cached_clip(clip_key, final_filepath):
+            logger.info(f"Trecho reaproveitado do cache: {download_id[:8]}")
+            if not finish_download(session_id, download_id, final_filename, final_filepath, base_name):
+                discard_cancelled_file(final_filepath)
+                return False
+            return True
         
-        # Ler saída
-        output_lines = []
-        for line in process.stdout:
-            line = line.strip()
-            output_lines.append(line)
+        # Presets com merge/conversão e corte preciso usam os limites de transcode
+        if option in TRANSCODE_OPTIONS or (clip and clip['accurate']):
+            child_class = 'transcode'
+        else:
+            child_class = 'download'
+        resources = None
+        
+        # Aguardar vaga no escalonador (jobs curtos passam na frente)
+        duration = clip['end'] - clip['start'] if clip else video_info['duration']
+        cost = DownloadScheduler.estimate_cost(duration, option)
+        if not download_scheduler.acquire(download_id, cost, session_id):
+            return False
+        with _status_lock:
+            if session_id in download_sessions and download_id in download_sessions[session_id]['status']:
+                download_sessions[session_id]['status'][download_id]['message'] = 'Iniciando download...'
+                touch_session(session_id)
+        
+        attempt = 0
+        while True:
+            # Executar processo
+            process = subprocess.Popen(
+                child_command(cmd, child_class),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                bufsize=1,
+                universal_newlines=True,
+                shell=False,
+                **child_popen_kwargs(child_class, new_group=True)
+            )
             
-            with _status_lock:
-                if session_id in download_sessions and download_id in download_sessions[session_id]['status']:
-                    download_sessions[session_id]['status'][download_id]['logs'].append(line)
-                    if len(download_sessions[session_id]['status'][download_id]['logs']) > 100:
-                        download_sessions[session_id]['status'][download_id]['logs'].pop(0)
+            with _process_lock:
+                active_processes[download_id] = {
+                    'process': process,
+                    'session_id': session_id,
+                    'last_activity': time.time(),
+                    'phase': 'download',
+                    'stalled': False
+                }
+            if download_id in cancelled_downloads:
+                kill_process_tree(process)
             
-            # Detectar progresso
-            if '[download]' in line and '%' in line:
-                percent_match = re.search(r'(\d+\.?\d*)%', line)
-                if percent_match:
-                    progress = float(percent_match.group(1))
-                    with _status_lock:
-                        if session_id in download_sessions and download_id in download_sessions[session_id]['status']:
-                            download_sessions[session_id]['status'][download_id]['progress'] = progress
-                            download_sessions[session_id]['status'][download_id]['message'] = line
+            # Ler saída
+            output_lines = []
+            last_progress = None
+            for line in process.stdout:
+                line = line.strip()
+                output_lines.append(line)
+                
+                with _status_lock:
+                    if session_id in download_sessions and download_id in download_sessions[session_id]['status']:
+                        download_sessions[session_id]['status'][download_id]['logs'].append(line)
+                        if len(download_sessions[session_id]['status'][download_id]['logs']) > 100:
+                            download_sessions[session_id]['status'][download_id]['logs'].pop(0)
+                        touch_session(session_id)
+                
+                # Fase atual: o timeout de travamento depende dela
+                if line.startswith('[download]'):
+                    phase = 'download'
+                elif POSTPROCESSOR_TAG.match(line):
+                    phase = 'postprocess'
+                else:
+                    phase = None
+                
+                # Detectar progresso
+                if '[download]' in line and '%' in line:
+                    percent_match = re.search(r'(\d+\.?\d*)%', line)
+                    if percent_match:
+                        progress = float(percent_match.group(1))
+                        with _status_lock:
+                            if session_id in download_sessions and download_id in download_sessions[session_id]['status']:
+                                download_sessions[session_id]['status'][download_id]['progress'] = progress
+                                download_sessions[session_id]['status'][download_id]['message'] = line
+                                touch_session(session_id)
+                        # Linhas repetidas com o mesmo percentual não contam como progresso
+                        if progress == last_progress:
+                            continue
+                        last_progress = progress
+                
+                with _process_lock:
+                    if download_id in active_processes:
+                        active_processes[download_id]['last_activity'] = time.time()
+                        if phase:
+                            active_processes[download_id]['phase'] = phase
+            
+            # Aguardar término (e coletar CPU, memória e E/S do processo)
+            resources = add_resource_usage(resources, wait_with_rusage(process))
+            
+            with _process_lock:
+                entry = active_processes.pop(download_id, None)
+            
+            if download_id in cancelled_downloads:
+                remove_temp_files(session_id, download_id)
+                return False
+            
+            # Encerrado pela drenagem: manter o .part e o registro no diário
+            if shutdown_event.is_set() and process.returncode != 0:
+                return False
+            
+            if entry and entry['stalled'] and attempt < app.config['STALL_MAX_RETRIES']:
+                attempt += 1
+                backoff = app.config['STALL_RETRY_BACKOFF_SECONDS'] * (2 ** (attempt - 1))
+                with _process_lock:
+                    watchdog_stats['retried'] += 1
+                with _status_lock:
+                    if session_id in download_sessions and download_id in download_sessions[session_id]['status']:
+                        download_sessions[session_id]['status'][download_id]['message'] = (
+                            f"Download travado, nova tentativa em {backoff}s ({attempt}/{app.config['STALL_MAX_RETRIES']})"
+                        )
+                        touch_session(session_id)
+                time.sleep(backoff)
+                if download_id in cancelled_downloads:
+                    remove_temp_files(session_id, download_id)
+                    return False
+                if shutdown_event.is_set():
+                    return False
+                continue
+            
+            break
         
-        # Aguardar término
-        process.wait()
+        record_resource_usage(child_class, resources)
         
         if process.returncode == 0 and os.path.exists(temp_filepath):
             # Renomear arquivo temporário para nome final
             os.rename(temp_filepath, final_filepath)
             
-            # Registrar download concluído
-            file_size = os.path.getsize(final_filepath)
-            
-            with _status_lock:
-                if session_id in download_sessions:
-                    # Atualizar status
-                    download_sessions[session_id]['status'][download_id] = {
-                        'status': 'completed',
-                        'message': 'Download concluído com sucesso!',
-                        'progress': 100,
-                        'filename': final_filename,
-                        'filepath': final_filepath,
-                        'original_name': base_name,
-                        'file_size': file_size,
-                        'complete_time': datetime.now().isoformat()
-                    }
-                    
-                    # Adicionar à lista de downloads do usuário
-                    download_info = {
-                        'id': download_id,
-                        'filename': final_filename,
-                        'original_name': base_name,
-                        'file_size': file_size,
-                        'created': datetime.now().isoformat(),
-                        'expires_at': (datetime.now() + timedelta(hours=app.config['MAX_FILE_AGE_HOURS'])).isoformat()
-                    }
-                    
-                    # Manter apenas os últimos 20 downloads
-                    download_sessions[session_id]['downloads'].append(download_info)
-                    if len(download_sessions[session_id]['downloads']) > 20:
-                        download_sessions[session_id]['downloads'] = download_sessions[session_id]['downloads'][-20:]
-            
+            if not finish_download(session_id, download_id, final_filename, final_filepath, base_name, resources):
+                discard_cancelled_file(final_filepath)
+                return False
+            if clip_key:
+                with _clip_cache_lock:
+                    clip_cache[clip_key] = final_filepath
             return True
         else:
-            # Limpar arquivo temporário se existir
-            if os.path.exists(temp_filepath):
-                try:
-                    os.remove(temp_filepath)
-                except:
-                    pass
+            # Limpar arquivo temporário e fragmentos (.part, .fNNN) mantidos
+            # pelo --continue entre as tentativas
+            remove_temp_files(session_id, download_id)
         
         # Se chegou aqui, algo deu errado
+        if entry and entry['stalled']:
+            error_message = 'Download travado sem progresso'
+        else:
+            error_message = 'Erro durante o download'
         with _status_lock:
             if session_id in download_sessions and download_id in download_sessions[session_id]['status']:
                 download_sessions[session_id]['status'][download_id] = {
                     'status': 'error',
-                    'message': 'Erro durante o download',
+                    'message': error_message,
                     'progress': 0,
-                    'error_output': '\n'.join(output_lines[-10:])
+                    'error_output': '\n'.join(output_lines[-10:]),
+                    'resources': resources
                 }
+                touch_session(session_id)
+        job_journal.record('failed', download_id, message=error_message)
         return False
         
     except Exception as e:
@@ -397,8 +1172,255 @@ def download_task(session_id, download_id, url, option, custom_filename=None):
                     'message': f"Erro: {str(e)}",
                     'progress': 0
                 }
+                touch_session(session_id)
+        job_journal.record('failed', download_id, message=str(e))
         return False
 
+def remove_temp_files(session_id, download_id):
+    """Remove os arquivos temporários (temp_<download_id>*) de um download"""
+    user_folder = os.path.join(download_path, f"user_{session_id}")
+    if not os.path.isdir(user_folder):
+        return 0
+    
+    removed = 0
+    prefix = f"temp_{download_id}"
+    for filename in os.listdir(user_folder):
+        if filename.startswith(prefix):
+            try:
+                os.remove(os.path.join(user_folder, filename))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+def cancel_download(session_id, download_id):
+    """Cancela um download em andamento e limpa seus arquivos temporários"""
+    with _status_lock:
+        status = download_sessions.get(session_id, {}).get('status', {}).get(download_id)
+        if status is None or status.get('status') != 'downloading':
+            return False
+        cancelled_downloads.add(download_id)
+        download_sessions[session_id]['status'][download_id] = {
+            'status': 'cancelled',
+            'message': 'Download cancelado',
+            'progress': status.get('progress', 0)
+        }
+        touch_session(session_id)
+    
+    with _process_lock:
+        entry = active_processes.get(download_id)
+        watchdog_stats['cancelled'] += 1
+    if entry:
+        kill_process_tree(entry['process'])
+    
+    remove_temp_files(session_id, download_id)
+    download_scheduler.cancel(download_id)
+    job_journal.record('cancelled', download_id)
+    logger.info(f"Download cancelado: {download_id[:8]}")
+    return True
+
+def check_stalled_downloads():
+    """Encerra downloads sem progresso há mais tempo que o timeout da fase atual"""
+    timeouts = {
+        'download': app.config['STALL_TIMEOUT_SECONDS'],
+        'postprocess': app.config['POSTPROCESS_TIMEOUT_SECONDS']
+    }
+    now = time.time()
+    
+    with _process_lock:
+        stalled = [
+            (download_id, entry) for download_id, entry in active_processes.items()
+            if not entry['stalled'] and now - entry['last_activity'] > timeouts[entry['phase']]
+        ]
+        for download_id, entry in stalled:
+            entry['stalled'] = True
+            watchdog_stats['stalled'] += 1
+    
+    for download_id, entry in stalled:
+        timeout = timeouts[entry['phase']]
+        logger.warning(f"Download travado há mais de {timeout}s ({entry['phase']}), encerrando: {download_id[:8]}")
+        kill_process_tree(entry['process'])
+    
+    return len(stalled)
+
+def schedule_watchdog():
+    """Agenda a verificação periódica de downloads travados"""
+    def watchdog_task():
+        while True:
+            time.sleep(app.config['WATCHDOG_INTERVAL_SECONDS'])
+            try:
+                check_stalled_downloads()
+            except Exception as e:
+                logger.error(f"Erro no watchdog: {e}")
+    
+    watchdog_thread = threading.Thread(target=watchdog_task, daemon=True)
+    watchdog_thread.start()
+    logger.info("Watchdog de downloads agendado")
+
+def run_download_job(session_id, download_id, url, option, custom_filename=None, clip=None):
+    """Executa o download_task e sempre devolve a vaga ao escalonador"""
+    try:
+        return download_task(session_id, download_id, url, option, custom_filename, clip)
+    finally:
+        download_scheduler.release(download_id)
+        with _status_lock:
+            cancelled_downloads.discard(download_id)
+
+def start_download_thread(session_id, download_id, url, option, custom_filename=None, clip=None):
+    """Inicia o download em uma thread de segundo plano"""
+    thread = threading.Thread(
+        target=run_download_job,
+        args=(session_id, download_id, url, option, custom_filename, clip),
+        daemon=True
+    )
+    thread.start()
+    return thread
+
+def remove_orphan_temp_files(keep_ids):
+    """Remove arquivos temp_* que não pertencem a nenhum job retomável"""
+    removed = 0
+    for item in os.listdir(download_path):
+        item_path = os.path.join(download_path, item)
+        if not (os.path.isdir(item_path) and item.startswith('user_')):
+            continue
+        
+        for filename in os.listdir(item_path):
+            if not filename.startswith('temp_'):
+                continue
+            # temp_<download_id>.mp4, temp_<download_id>.mp4.part, temp_<download_id>.webp...
+            download_id = filename[len('temp_'):].split('.')[0]
+            if download_id in keep_ids:
+                continue
+            try:
+                os.remove(os.path.join(item_path, filename))
+                removed += 1
+            except OSError:
+                pass
+    
+    if removed > 0:
+        logger.info(f"Arquivos temporários órfãos removidos: {removed}")
+    return removed
+
+def recover_jobs():
+    """Reproduz o diário de jobs e retoma downloads interrompidos por um reinício"""
+    jobs = job_journal.replay()
+    max_age = timedelta(hours=app.config['MAX_FILE_AGE_HOURS'])
+    now = datetime.now()
+    
+    kept = []
+    to_resume = []
+    
+    for download_id, job in jobs.items():
+        session_id = job.get('session_id')
+        if not session_id:
+            continue
+        
+        event = job.get('event')
+        try:
+            last_update = datetime.fromisoformat(job['ts'])
+        except (KeyError, ValueError):
+            continue
+        
+        # Jobs finalizados e antigos não precisam mais ser lembrados
+        if event in ('completed', 'failed', 'cancelled') and now - last_update > max_age:
+            continue
+        if event == 'completed' and not os.path.exists(job.get('filepath', '')):
+            continue
+        
+        with _status_lock:
+            if session_id not in download_sessions:
+                download_sessions[session_id] = {
+                    'downloads': [],
+                    'status': {},
+                    'created': now.isoformat(),
+                    'version': next(_session_versions)
+                }
+            sess = download_sessions[session_id]
+            
+            if event == 'completed':
+                sess['status'][download_id] = {
+                    'status': 'completed',
+                    'message': 'Download concluído com sucesso!',
+                    'progress': 100,
+                    'filename': job['filename'],
+                    'filepath': job['filepath'],
+                    'original_name': job.get('original_name'),
+                    'file_size': job.get('file_size', 0),
+                    'complete_time': job['ts'],
+                    'resources': job.get('resources')
+                }
+                sess['downloads'].append({
+                    'id': download_id,
+                    'filename': job['filename'],
+                    'original_name': job.get('original_name'),
+                    'file_size': job.get('file_size', 0),
+                    'created': job.get('created', job['ts']),
+                    'expires_at': job.get('expires_at', (last_update + max_age).isoformat())
+                })
+            elif event == 'failed':
+                sess['status'][download_id] = {
+                    'status': 'error',
+                    'message': job.get('message', 'Erro durante o download'),
+                    'progress': 0
+                }
+            elif event == 'cancelled':
+                sess['status'][download_id] = {
+                    'status': 'cancelled',
+                    'message': 'Download cancelado',
+                    'progress': 0
+                }
+            else:
+                # queued/running: o processo morreu junto com o servidor
+                job['attempts'] = job.get('attempts', 0) + 1
+                if job['attempts'] > app.config['JOURNAL_MAX_RESUMES']:
+                    job['event'] = 'failed'
+                    job['message'] = 'Download interrompido muitas vezes'
+                    sess['status'][download_id] = {
+                        'status': 'error',
+                        'message': job['message'],
+                        'progress': 0
+                    }
+                else:
+                    sess['status'][download_id] = {
+                        'status': 'downloading',
+                        'message': 'Retomando download após reinício...',
+                        'progress': 0,
+                        'logs': [],
+                        'start_time': now.isoformat(),
+                        'filename': job.get('filename'),
+                        'original_name': job.get('original_name')
+                    }
+                    to_resume.append(job)
+        
+        kept.append(job)
+    
+    # Mesmo limite de histórico aplicado em finish_download
+    with _status_lock:
+        for sess in download_sessions.values():
+            sess['downloads'] = sess['downloads'][-20:]
+    
+    job_journal.compact(kept)
+    remove_orphan_temp_files({job['download_id'] for job in to_resume})
+    
+    for job in to_resume:
+        logger.info(f"Retomando download {job['download_id'][:8]} (tentativa {job['attempts']})")
+        start_download_thread(
+            job['session_id'], job['download_id'], job['url'],
+            job.get('option', 'Video Best Quality'), job.get('custom_filename'),
+            job.get('clip')
+        )
+    
+    return len(to_resume)
+
+def add_queue_position(download_id, status):
+    """Informa a posição na fila enquanto o download aguarda uma vaga"""
+    if status.get('status') != 'downloading':
+        return
+    queue_position = download_scheduler.position(download_id)
+    if queue_position:
+        status['queue_position'] = queue_position
+        status['message'] = f"Na fila de downloads (posição {queue_position})"
+
 # ========== ROTAS DA APLICAÇÃO ==========
 
 @app.route('/')
@@ -427,7 +1449,8 @@ def api_get_info():
                 'author': info['author'],
                 'duration': info['duration'],
                 'views': info['views'],
-                'thumbnail': info['thumbnail']
+                'thumbnail': info['thumbnail'],
+                'chapters': info['chapters']
             })
         else:
             return jsonify({'error': info['error']}), 500
@@ -451,6 +1474,18 @@ def api_download():
         if not url:
             return jsonify({'error': 'URL não fornecida'}), 400
         
+        if shutdown_event.is_set():
+            return jsonify({
+                'success': False,
+                'error': 'Servidor reiniciando. Tente novamente em alguns instantes.'
+            }), 503
+        
+        # Trecho opcional (start_time/end_time ou chapter)
+        try:
+            clip = DownloadManager.parse_clip_request(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # Gerar ID único para este download
         download_id = str(uuid.uuid4())
         
@@ -470,13 +1505,30 @@ def api_download():
                 'error': 'Muitos downloads em andamento. Tente novamente em alguns instantes.'
             }), 429
         
-        # Iniciar thread de download
-        thread = threading.Thread(
-            target=download_task,
-            args=(session_id, download_id, url, option, custom_filename),
-            daemon=True
+        # Registrar no diário antes de iniciar, para sobreviver a reinícios
+        job_journal.record(
+            'queued', download_id,
+            session_id=session_id,
+            url=url,
+            option=option,
+            custom_filename=custom_filename,
+            clip=clip,
+            attempts=0
         )
-        thread.start()
+        
+        # Status inicial: permite cancelar já durante a consulta ao yt-dlp
+        with _status_lock:
+            if session_id in download_sessions:
+                download_sessions[session_id]['status'][download_id] = {
+                    'status': 'downloading',
+                    'message': 'Obtendo informações do vídeo...',
+                    'progress': 0,
+                    'logs': [],
+                    'start_time': datetime.now().isoformat()
+                }
+                touch_session(session_id)
+        
+        start_download_thread(session_id, download_id, url, option, custom_filename, clip)
         
         return jsonify({
             'success': True,
@@ -508,6 +1560,8 @@ def api_status(download_id):
                     minutes_left = max(0, int(time_left.total_seconds() / 60))
                     status['expires_in_minutes'] = minutes_left
                 
+                add_queue_position(download_id, status)
+                
                 # Limitar logs retornados
                 if 'logs' in status and len(status['logs']) > 20:
                     status['logs'] = status['logs'][-20:]
@@ -524,6 +1578,75 @@ def api_status(download_id):
         logger.error(f"Erro ao verificar status: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/download/<download_id>', methods=['DELETE'])
+def api_cancel_download(download_id):
+    """API para cancelar um download em andamento"""
+    try:
+        session_id = get_or_create_session()
+        
+        if not cancel_download(session_id, download_id):
+            return jsonify({
+                'success': False,
+                'error': 'Download não encontrado ou já finalizado'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'download_id': download_id,
+            'message': 'Download cancelado'
+        })
+        
+    except Exception as e:
+        logger.error(f"Erro ao cancelar download: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/session/state')
+def api_session_state():
+    """Estado completo da sessão (downloads ativos + histórico) com ETag/304"""
+    try:
+        session_id = get_or_create_session()
+        
+        # Caminho rápido: leitura atômica da versão, sem lock e sem montar JSON
+        sess = download_sessions.get(session_id)
+        version = sess['version'] if sess else 0
+        etag = f"{BOOT_ID}-{version}"
+        
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+        
+        with _status_lock:
+            sess = download_sessions.get(session_id)
+            if sess is None:
+                version, active, history = 0, {}, []
+            else:
+                version = sess['version']
+                active = {}
+                for download_id, status in sess['status'].items():
+                    status = status.copy()
+                    status.pop('filepath', None)
+                    # Limitar logs retornados
+                    if 'logs' in status:
+                        status['logs'] = status['logs'][-20:]
+                    add_queue_position(download_id, status)
+                    active[download_id] = status
+                history = [download.copy() for download in sess['downloads']]
+        
+        response = jsonify({
+            'session_id': session_id,
+            'version': version,
+            'downloads': active,
+            'history': history
+        })
+        response.set_etag(f"{BOOT_ID}-{version}")
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+        
+    except Exception as e:
+        logger.error(f"Erro ao obter estado da sessão: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/download/<filename>')
 def download_file(filename):
     """Serve o arquivo para download (apenas para o usuário da sessão)"""
@@ -723,6 +1846,16 @@ def api_stats():
                 if status.get('status') == 'downloading'
             )
         
+        with _process_lock:
+            watchdog_snapshot = dict(watchdog_stats)
+            watchdog_snapshot['running_processes'] = len(active_processes)
+            resources_snapshot = {}
+            for child_class, totals in resource_stats.items():
+                resources_snapshot[child_class] = dict(totals)
+                resources_snapshot[child_class]['avg_cpu_seconds'] = (
+                    round(totals['cpu_seconds'] / totals['jobs'], 3) if totals['jobs'] else 0
+                )
+        
         # Espaço livre
         if sys.platform == 'win32':
             import ctypes
@@ -743,7 +1876,10 @@ def api_stats():
             'active_downloads': active_downloads,
             'active_sessions': active_sessions,
             'free_space_mb': round(free_space / (1024 * 1024), 2),
-            'max_file_age_hours': app.config['MAX_FILE_AGE_HOURS']
+            'max_file_age_hours': app.config['MAX_FILE_AGE_HOURS'],
+            'watchdog': watchdog_snapshot,
+            'scheduler': download_scheduler.snapshot(),
+            'resources': resources_snapshot
         })
         
     except Exception as e:
@@ -767,9 +1903,129 @@ def check_required_files():
     
     return len(missing) == 0
 
+def stop_active_downloads():
+    """Encerra os processos restantes; os jobs ficam no diário para retomada"""
+    with _process_lock:
+        entries = list(active_processes.values())
+    for entry in entries:
+        kill_process_tree(entry['process'])
+    return len(entries)
+
+def drain_downloads(timeout):
+    """Para de aceitar jobs e espera os downloads em andamento terminarem"""
+    shutdown_event.set()
+    download_scheduler.close()
+    
+    deadline = time.time() + timeout
+    while time.time() < deadline and download_scheduler.snapshot()['running'] > 0:
+        time.sleep(1)
+    
+    remaining = download_scheduler.snapshot()['running']
+    if remaining:
+        logger.warning(f"Tempo de drenagem esgotado: {remaining} download(s) ficam no diário para retomada")
+        stop_active_downloads()
+    else:
+        logger.info("Todos os downloads em andamento foram concluídos")
+    return remaining
+
+_services_lock = threading.Lock()
+_services_started = False
+
+def start_background_services():
+    """Inicia limpeza, watchdog e retomada de jobs (uma única vez por processo)"""
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return False
+        _services_started = True
+    
+    schedule_cleanup()
+    schedule_watchdog()
+    
+    resumed = recover_jobs()
+    if resumed:
+        logger.info(f"{resumed} download(s) interrompido(s) retomado(s)")
+    return True
+
+def create_app():
+    """Fábrica WSGI: retorna o app com os serviços de fundo iniciados.
+    
+    O estado das sessões fica em memória, então sirva com um único processo
+    e várias threads. A drenagem no SIGTERM (recusar novos jobs e esperar os
+    downloads) só existe em serve(), ou seja, ao rodar com python app.py;
+    outros servidores WSGI tratam o SIGTERM por conta própria e não drenam.
+    """
+    check_required_files()
+    start_background_services()
+    return app
+
+def serve(host, port, threads):
+    """Servidor de produção com drenagem graciosa no SIGTERM"""
+    wsgi_app = create_app()
+    
+    try:
+        from waitress import create_server
+        from waitress.trigger import trigger
+        from waitress.wasyncore import close_all
+        
+        # Mapa de sockets próprio: vale tanto para um servidor quanto para o
+        # MultiSocketServer (host com vários endereços, ex.: localhost IPv4+IPv6)
+        socket_map = {}
+        server = create_server(wsgi_app, map=socket_map, host=host, port=port, threads=threads)
+        stop_trigger = trigger(socket_map)
+        run_server = server.run
+        
+        def stop_server():
+            # Executado no loop do waitress: fecha os sockets de escuta e as
+            # conexões keep-alive, e o loop termina ao ficar sem canais
+            stop_trigger.pull_trigger(lambda: close_all(socket_map))
+    except ImportError:
+        logger.warning("waitress não instalado (pip install waitress), usando o servidor do Werkzeug")
+        from werkzeug.serving import make_server
+        server = make_server(host, port, wsgi_app, threaded=True)
+        run_server = server.serve_forever
+        stop_server = server.shutdown
+    
+    stop_requested = threading.Event()
+    
+    def drain_and_stop():
+        stop_requested.wait()
+        logger.info("Sinal de encerramento recebido, drenando downloads...")
+        drain_downloads(app.config['DRAIN_TIMEOUT_SECONDS'])
+        stop_server()
+    
+    def handle_signal(signum, frame):
+        # Apenas sinaliza: a drenagem e a parada do servidor ficam na thread
+        if not stop_requested.is_set():
+            stop_requested.set()
+            return
+        # Segundo sinal: sair já, deixando os jobs no diário para retomada
+        stop_active_downloads()
+        os._exit(1)
+    
+    threading.Thread(target=drain_and_stop, daemon=True).start()
+    
+    for sig_name in ('SIGTERM', 'SIGINT', 'SIGBREAK'):
+        if hasattr(signal, sig_name):
+            signal.signal(getattr(signal, sig_name), handle_signal)
+    
+    run_server()
+    if hasattr(server, 'task_dispatcher'):
+        server.task_dispatcher.shutdown()
+    
+    logger.info("Servidor encerrado")
+
 # ========== INICIALIZAÇÃO ==========
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Amazed YouTube Downloader Web")
+    parser.add_argument('--dev', action='store_true',
+                        help="servidor de desenvolvimento do Flask (debug + reloader)")
+    parser.add_argument('--host', default=app.config['SERVER_HOST'])
+    parser.add_argument('--port', type=int, default=app.config['SERVER_PORT'])
+    parser.add_argument('--threads', type=int, default=app.config['SERVER_THREADS'])
+    args = parser.parse_args()
+    
     # Verificar arquivos necessários
     files_ok = check_required_files()
     
@@ -782,9 +2038,6 @@ if __name__ == '__main__':
     else:
         print("✓ Todos os arquivos necessários encontrados")
     
-    # Iniciar limpeza automática
-    schedule_cleanup()
-    
     print("=" * 60)
     print("Amazed YouTube Downloader Web v1.4")
     print("=" * 60)
@@ -796,12 +2049,19 @@ if __name__ == '__main__':
     print(f"Pasta base: {download_path}")
     print(f"Arquivos expiram após: {app.config['MAX_FILE_AGE_HOURS']} hora(s)")
     print(f"Limpeza automática a cada: {app.config['CLEANUP_INTERVAL_MINUTES']} minuto(s)")
-    print(f"Servidor rodando em: http://localhost:5000")
+    print(f"Servidor rodando em: http://localhost:{args.port}")
     print("=" * 60)
     
     try:
-        app.run(debug=True, host='0.0.0.0', port=5003)
+        if args.dev:
+            # O reloader executa este bloco também no processo pai, que só
+            # observa os arquivos: os serviços rodam apenas no processo filho
+            if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+                start_background_services()
+            app.run(debug=True, host=args.host, port=args.port)
+        else:
+            serve(args.host, args.port, args.threads)
     except KeyboardInterrupt:
         print("\nServidor encerrado.")
     except Exception as e:
-        print(f"Erro ao iniciar servidor: {e}")
\ No newline at end of file
+        print(f"Erro ao iniciar servidor: {e}")
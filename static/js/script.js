@@ -14,7 +14,8 @@ class YouTubeDownloader {
             selectedOption: null,
             currentDownloadUrl: null,
             isDownloading: false,
-            pollInterval: null
+            pollInterval: null,
+            stateEtag: null
         };
 
         // Cache de elementos DOM
@@ -427,10 +428,15 @@ class YouTubeDownloader {
             if (!this.state.downloadId) return;
             
             try {
-                const response = await fetch(`/api/status/${this.state.downloadId}`);
-                if (!response.ok) return;
+                // Estado da sessão inteira; 304 = nada mudou desde o último poll
+                const headers = this.state.stateEtag ? { 'If-None-Match': this.state.stateEtag } : {};
+                const response = await fetch('/api/session/state', { headers, cache: 'no-store' });
+                if (response.status === 304 || !response.ok) return;
                 
-                const data = await response.json();
+                this.state.stateEtag = response.headers.get('ETag');
+                const state = await response.json();
+                const data = state.downloads?.[this.state.downloadId];
+                if (!data) return;
                 
                 switch (data.status) {
                     case 'downloading':
@@ -447,6 +453,12 @@ class YouTubeDownloader {
                     case 'error':
                         this.handleDownloadError(data);
                         break;
+                        
+                    case 'cancelled':
+                        this.stopPolling();
+                        this.state.isDownloading = false;
+                        this.updateProgress(0, 'Cancelado');
+                        break;
                 }
             } catch (error) {
                 console.error('Erro no polling:', error);
@@ -645,12 +657,21 @@ class YouTubeDownloader {
         this.showNotification('Funcionalidade em desenvolvimento', 'info');
     }
 
-    cancelDownload() {
+    async cancelDownload() {
         if (!this.state.isDownloading) return;
         
         if (confirm('Cancelar este download?')) {
             this.stopPolling();
             this.state.isDownloading = false;
+            
+            if (this.state.downloadId) {
+                try {
+                    await fetch(`/api/download/${this.state.downloadId}`, { method: 'DELETE' });
+                } catch (error) {
+                    console.error('Erro ao cancelar download:', error);
+                }
+            }
+            
             this.hideElement(this.elements.cards.progress);
             this.addLog('Download cancelado', 'warning');
         }